@@ -1,25 +1,6 @@
 import streamlit as st
 import json
-
-# Recommended values for standard setup
-RECOMMENDED_VALUES = {
-    "Power Law Red Noise": {
-        "amplitude": {"min_value": -18, "max_value": -10},
-        "spectral_index": {"min_value": 0, "max_value": 7},
-    },
-    "Power Law DM Noise": {
-        "amplitude": {"min_value": -18, "max_value": -10},
-        "spectral_index": {"min_value": 0, "max_value": 7},
-    },
-    "EFAC": {
-        "global": {"min_value": -1, "max_value": 0.7},
-        "per_flag": {"min_value": -1, "max_value": 0.7},
-    },
-    "EQUAD": {
-        "global": {"min_value": -9, "max_value": -3},
-        "per_flag": {"min_value": -9, "max_value": -3},
-    },
-}
+from tempo_constants import ELEMENT_TYPES, RECOMMENDED_VALUES, param_keys
 
 st.title("TempoNest JSON Configuration File Generator")
 
@@ -51,86 +32,97 @@ with col2:
 # Elements
 st.header("Elements")
 elements = []
-element_types = ["Timing Model", "Power Law Red Noise", "Power Law DM Noise", "EFAC", "EQUAD"]
-
-num_elements = st.number_input("Number of Elements", value=1, min_value=1, step=1)
 
-for i in range(num_elements):
-    st.subheader(f"Element {i + 1}")
+# Element widgets are batched in a form so editing them does not rerun the app
+with st.form("cfg"):
+    num_elements = st.number_input("Number of Elements", value=1, min_value=1, step=1)
+
+    for i in range(num_elements):
+        st.subheader(f"Element {i + 1}")
+        # Widgets of different heights get their own rows so their columns line up
+        col1, col2 = st.columns(2)
+        with col1:
+            element_name = st.selectbox(f"Element Name {i + 1}", ELEMENT_TYPES, key=f"element_name_{i}")
+
+        parameters = []
+        if element_name in ["EFAC", "EQUAD"]:
+            selected_model = st.radio(
+                f"Select Model Type for {element_name}",
+                ("Global", "Per Flag"),
+                key=f"model_type_{i}"
+            )
+
+            if selected_model == "Global":
+                col1, col2 = st.columns(2)
+                with col1:
+                    min_value = st.number_input(f"Global Min Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["global"]["min_value"], key=f"global_min_{i}")
+                with col2:
+                    max_value = st.number_input(f"Global Max Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["global"]["max_value"], key=f"global_max_{i}")
+
+                parameters.append({
+                    "name": "global",
+                    "description": f"global scaling for {element_name.lower()} error bars",
+                    "prior_type": "uniform" if element_name == "EFAC" else "log_uniform",
+                    "include": True,
+                    "fit": True,
+                    "min_value": min_value,
+                    "max_value": max_value,
+                })
+
+            elif selected_model == "Per Flag":
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    min_value = st.number_input(f"Per Flag Min Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["per_flag"]["min_value"], key=f"per_flag_min_{i}")
+                with col2:
+                    max_value = st.number_input(f"Per Flag Max Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["per_flag"]["max_value"], key=f"per_flag_max_{i}")
+                with col3:
+                    flag = st.text_input(f"Flag for {element_name}", value="-fe", key=f"per_flag_flag_{i}")
+
+                parameters.append({
+                    "name": "per_flag",
+                    "description": f"per flag model for {element_name.lower()} error bars",
+                    "prior_type": "uniform" if element_name == "EFAC" else "log_uniform",
+                    "include": True,
+                    "fit": True,
+                    "min_value": min_value,
+                    "max_value": max_value,
+                    "flag": flag,
+                })
+
+        elif element_name in RECOMMENDED_VALUES:
+            for param_name, param_vals in RECOMMENDED_VALUES[element_name].items():
+                include_key, fit_key, min_key, max_key = param_keys(i, param_name)
+                # Each parameter gets its own row so its checkboxes and inputs line up
+                col1, col2 = st.columns(2)
+                with col1:
+                    include = st.checkbox(f"Include {param_name}", value=True, key=include_key)
+                    fit = st.checkbox(f"Fit {param_name}", value=True, key=fit_key)
+                with col2:
+                    min_value = st.number_input(f"{param_name} Min Value", 
+                                                value=param_vals["min_value"], 
+                                                key=min_key)
+                    max_value = st.number_input(f"{param_name} Max Value", 
+                                                value=param_vals["max_value"], 
+                                                key=max_key)
+                parameters.append({
+                    "name": param_name,
+                    "prior_type": "log_uniform" if param_name in ["amplitude", "global", "per_flag"] else "uniform",
+                    "include": include,
+                    "fit": fit,
+                    "min_value": min_value,
+                    "max_value": max_value,
+                })
+        elements.append({"name": element_name, "parameters": parameters})
+
+    # Generating submits the form too, so the config always matches the widgets on screen
     col1, col2 = st.columns(2)
     with col1:
-        element_name = st.selectbox(f"Element Name {i + 1}", element_types, key=f"element_name_{i}")
-
-    parameters = []
-    if element_name in ["EFAC", "EQUAD"]:
-        selected_model = st.radio(
-            f"Select Model Type for {element_name}",
-            ("Global", "Per Flag"),
-            key=f"model_type_{i}"
-        )
-
-        if selected_model == "Global":
-            col1, col2 = st.columns(2)
-            with col1:
-                min_value = st.number_input(f"Global Min Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["global"]["min_value"], key=f"global_min_{i}")
-            with col2:
-                max_value = st.number_input(f"Global Max Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["global"]["max_value"], key=f"global_max_{i}")
-
-            parameters.append({
-                "name": "global",
-                "description": f"global scaling for {element_name.lower()} error bars",
-                "prior_type": "uniform" if element_name == "EFAC" else "log_uniform",
-                "include": True,
-                "fit": True,
-                "min_value": min_value,
-                "max_value": max_value,
-            })
-
-        elif selected_model == "Per Flag":
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                min_value = st.number_input(f"Per Flag Min Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["per_flag"]["min_value"], key=f"per_flag_min_{i}")
-            with col2:
-                max_value = st.number_input(f"Per Flag Max Value for {element_name}", value=RECOMMENDED_VALUES[element_name]["per_flag"]["max_value"], key=f"per_flag_max_{i}")
-            with col3:
-                flag = st.text_input(f"Flag for {element_name}", value="-fe", key=f"per_flag_flag_{i}")
-
-            parameters.append({
-                "name": "per_flag",
-                "description": f"per flag model for {element_name.lower()} error bars",
-                "prior_type": "uniform" if element_name == "EFAC" else "log_uniform",
-                "include": True,
-                "fit": True,
-                "min_value": min_value,
-                "max_value": max_value,
-                "flag": flag,
-            })
-
-    elif element_name in RECOMMENDED_VALUES:
-        for param_name, param_vals in RECOMMENDED_VALUES[element_name].items():
-            col1, col2 = st.columns(2)
-            with col1:
-                include = st.checkbox(f"Include {param_name}", value=True, key=f"include_{i}_{param_name}")
-                fit = st.checkbox(f"Fit {param_name}", value=True, key=f"fit_{i}_{param_name}")
-            with col2:
-                min_value = st.number_input(f"{param_name} Min Value", 
-                                            value=param_vals["min_value"], 
-                                            key=f"min_{i}_{param_name}")
-                max_value = st.number_input(f"{param_name} Max Value", 
-                                            value=param_vals["max_value"], 
-                                            key=f"max_{i}_{param_name}")
-            parameters.append({
-                "name": param_name,
-                "prior_type": "log_uniform" if param_name in ["amplitude", "global", "per_flag"] else "uniform",
-                "include": include,
-                "fit": fit,
-                "min_value": min_value,
-                "max_value": max_value,
-            })
-    elements.append({"name": element_name, "parameters": parameters})
+        st.form_submit_button("Apply")
+    with col2:
+        generate = st.form_submit_button("Generate JSON")
 
 # Generate JSON
-if st.button("Generate JSON"):
+if generate:
     config = {
         "globals": {
             "root": root,
@@ -147,6 +139,7 @@ if st.button("Generate JSON"):
         },
         "elements": elements,
     }
+    st.session_state.generated_config = config
     st.session_state.generated_json = json.dumps(config, indent=4)
 
 # Input for the filename
@@ -155,7 +148,7 @@ file_name = st.text_input("Specify the name of the config file to save as", valu
 # Display the generated JSON if available
 if "generated_json" in st.session_state:
     st.subheader("Generated JSON")
-    st.json(json.loads(st.session_state.generated_json))
+    st.json(st.session_state.generated_config)
     st.download_button(
         label="Download JSON File",
         data=st.session_state.generated_json,
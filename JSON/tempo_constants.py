@@ -0,0 +1,35 @@
+from functools import lru_cache
+from types import MappingProxyType
+
+# Element types that can be added to a TempoNest configuration
+ELEMENT_TYPES = ("Timing Model", "Power Law Red Noise", "Power Law DM Noise", "EFAC", "EQUAD")
+
+# Recommended values for standard setup
+RECOMMENDED_VALUES = MappingProxyType({
+    "Power Law Red Noise": {
+        "amplitude": {"min_value": -18, "max_value": -10},
+        "spectral_index": {"min_value": 0, "max_value": 7},
+    },
+    "Power Law DM Noise": {
+        "amplitude": {"min_value": -18, "max_value": -10},
+        "spectral_index": {"min_value": 0, "max_value": 7},
+    },
+    "EFAC": {
+        "global": {"min_value": -1, "max_value": 0.7},
+        "per_flag": {"min_value": -1, "max_value": 0.7},
+    },
+    "EQUAD": {
+        "global": {"min_value": -9, "max_value": -3},
+        "per_flag": {"min_value": -9, "max_value": -3},
+    },
+})
+
+
+@lru_cache(maxsize=None)
+def param_keys(i, param_name):
+    """
+    Widget keys for the include, fit, min and max inputs of a parameter.
+    Lives here rather than in the app so the cache survives Streamlit reruns.
+    """
+    return (f"include_{i}_{param_name}", f"fit_{i}_{param_name}",
+            f"min_{i}_{param_name}", f"max_{i}_{param_name}")
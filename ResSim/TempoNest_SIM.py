@@ -1,161 +1,248 @@
+import io
 import os
+import tempfile
+import threading
 import uuid
 import zipfile
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
 import libstempo.toasim as lsim
 import streamlit as st
-import gc
+
+# Parfile used for every fake pulsar, resolved next to this script
+PARFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake.par")
+
+
+@st.cache_resource(max_entries=8)
+def build_combined_psr(obstimes_bytes, toaerr_bytes, freq_bytes, red_params, dm_params, efac, seed=None):
+    """
+    Builds the combined fake pulsar and injects red, DM and white noise.
+    Each injection gets its own seed derived from `seed`, so the noise is
+    reproducible without the red and DM draws being correlated.
+    The arrays are passed as bytes so they can be hashed by the cache;
+    the pulsar is shared between reruns, so the returned arrays are copies.
+    Every cache hit returns the same copies, so they are made read-only.
+    """
+    obstimes = np.frombuffer(obstimes_bytes, dtype=np.float64)
+    toaerr = np.frombuffer(toaerr_bytes, dtype=np.float64)
+    freqs = np.frombuffer(freq_bytes, dtype=np.float64)
+
+    psr = lsim.fakepulsar(parfile=PARFILE, obstimes=obstimes, toaerr=toaerr, freq=freqs)
+
+    if seed is None:
+        red_seed = dm_seed = efac_seed = None
+    else:
+        red_seed, dm_seed, efac_seed = (int(s) for s in np.random.SeedSequence(seed).generate_state(3))
+
+    lsim.add_rednoise(psr, *red_params, seed=red_seed)  # Add red noise
+    lsim.add_dm(psr, *dm_params, seed=dm_seed)  # Add DM noise (freq-dependent)
+    lsim.add_efac(psr, efac=efac, seed=efac_seed)  # Apply EFAC to combined residuals
+
+    residuals = psr.residuals().copy()
+    toaerrs = psr.toaerrs.copy()
+    residuals.setflags(write=False)
+    toaerrs.setflags(write=False)
+
+    return psr, residuals, toaerrs
+
+
+def fill_toa_block(mjds, freqs_out, errs, start_mjd, end_mjd, freq, avg_sn, rng):
+    """
+    Fills preallocated date, frequency and TOA error arrays for one frequency.
+    """
+    mjds[:] = np.linspace(start_mjd, end_mjd, mjds.shape[0])
+    freqs_out[:] = freq
+    sn_ratios = np.maximum(rng.normal(loc=avg_sn, scale=5.0, size=errs.shape[0]), 1e-3)
+    np.reciprocal(sn_ratios, out=errs)
+
+
+@st.cache_resource
+def _figure_skeleton():
+    """
+    Builds the residual plot figure once; it is cleared and redrawn for each plot.
+    The margins are fixed here instead of running tight_layout on every plot;
+    the legend outside the axes is kept in the image by saving with a tight bbox.
+    """
+    fig, ax = plt.subplots(figsize=(12, 6))
+    fig.subplots_adjust(left=0.07, right=0.78, bottom=0.1, top=0.92)
+    return fig, ax
+
+
+@st.cache_resource
+def _figure_lock():
+    """
+    Guards the shared figure while a session draws and saves it.
+    """
+    return threading.Lock()
+
 
 class ResidualSimulator:
     def __init__(self):
         self.psr_combined = None
 
-    def simulate_residuals_freq(self, X_days, freq, totaltime, avg_sn):
+    def simulate_residuals(self, cadence_days, observing_freqs, red_noise_params, dm_noise_params, totaltime, efac_value, avg_sn, seed=None):
         """
-        This injects white noise at a single frequency and returns a dataframe.
+        Injects white noise at each frequency into one set of flat arrays, then
+        builds a single fake pulsar on the combined TOAs and adds the noise.
+        All of the noise, white, red and DM, is seeded from `seed`.
         """
+        rng = np.random.default_rng(seed)
+
         start_mjd = 56658  # MJD start time (2014)
         end_mjd = start_mjd + 365.25 * totaltime  # Total time span in years
-        n_toas = int((end_mjd - start_mjd) / X_days)  # Number of TOAs
-
-        mjds = np.linspace(start_mjd, end_mjd, n_toas)
-        freqs = np.full(n_toas, freq)
-        
-        sn_ratios = np.clip(np.random.normal(loc=avg_sn, scale=5.0, size=n_toas), a_min=1e-3, a_max=None)
-        toa_errors = (1.0 / sn_ratios)
-
-        # Here fakepulsar is used because whitening is required.
-        psr = lsim.fakepulsar(parfile="fake.par", obstimes=mjds, toaerr=toa_errors, freq=freqs)
-
-        # Extract residuals, errors, and frequencies
-        psr_toas = psr.toas()
-        psr_residuals = psr.residuals() / 1e-6  # Convert to microseconds
-        psr_errs = psr.toaerrs
-        psr_freqs = psr.freqs
-
-        # Create DataFrame
-        data = pd.DataFrame({
-            'Date': psr_toas,
-            'Residual': psr_residuals,
-            'Uncertainty': psr_errs,
-            'Frequency': psr_freqs
-        })
-
-        return data
-
-    def combine_residuals(self, data_list):
-        """
-        Combine residuals from different frequencies ensuring consistent data types.
-        """
-        for df in data_list:
-            df['Date'] = df['Date'].astype(np.float64)
-            df['Residual'] = df['Residual'].astype(np.float64)
-            df['Uncertainty'] = df['Uncertainty'].astype(np.float64)
-            df['Frequency'] = df['Frequency'].astype(np.float64)
-
-        combined_data = pd.concat(data_list, ignore_index=True)
-        combined_data = combined_data.sort_values(by=['Date', 'Frequency']).reset_index(drop=True)
-        return combined_data
-
-    def inject_dm_noise_on_combined(self, psr_combined, dm_noise_params, red_noise_params, efac_value):
-        lsim.add_rednoise(psr_combined, *red_noise_params)  # Add red noise
-        lsim.add_dm(psr_combined, *dm_noise_params)  # Add DM noise (freq-dependent)
-        lsim.add_efac(psr_combined, efac=efac_value)  # Apply EFAC to combined residuals
-        combined_residuals = psr_combined.residuals()
-        combined_toaerrs = psr_combined.toaerrs
-        return combined_residuals, combined_toaerrs
-
-    def simulate_residuals(self, cadence_days, observing_freqs, red_noise_params, dm_noise_params, totaltime, efac_value):
-        all_data = []
-        for freq in observing_freqs:
-            freq_data = self.simulate_residuals_freq(cadence_days, freq, totaltime, avg_sn)
-            all_data.append(freq_data)
-
-        combined_data = self.combine_residuals(all_data)
-
-        self.psr_combined = lsim.fakepulsar(parfile="fake.par", obstimes=combined_data['Date'].values,
-                                            toaerr=combined_data['Uncertainty'].values, freq=combined_data['Frequency'].values)
-
-        combined_residuals, combined_toaerrs = self.inject_dm_noise_on_combined(self.psr_combined, dm_noise_params, red_noise_params, efac_value)
+        n_toas = int((end_mjd - start_mjd) / cadence_days)  # Number of TOAs per frequency
+        n_total = n_toas * len(observing_freqs)
+
+        mjds = np.empty(n_total)
+        freqs = np.empty(n_total)
+        toa_errors = np.empty(n_total)
+        for k, freq in enumerate(observing_freqs):
+            sl = slice(k * n_toas, (k + 1) * n_toas)
+            fill_toa_block(mjds[sl], freqs[sl], toa_errors[sl], start_mjd, end_mjd, freq, avg_sn, rng)
+
+        # Sort by date, then frequency
+        order = np.lexsort((freqs, mjds))
+        mjds, freqs, toa_errors = mjds[order], freqs[order], toa_errors[order]
+
+        self.psr_combined, combined_residuals, combined_toaerrs = build_combined_psr(
+            mjds.tobytes(), toa_errors.tobytes(), freqs.tobytes(),
+            tuple(red_noise_params), tuple(dm_noise_params), efac_value, seed=seed
+        )
 
-        combined_data['Residual'] = combined_residuals / 1e-6  # Convert to microseconds
-        combined_data['Uncertainty'] = combined_toaerrs
+        # The only DataFrame in the pipeline, built for plotting
+        combined_data = pd.DataFrame({
+            'Date': mjds,
+            'Residual': combined_residuals / 1e-6,  # Convert to microseconds
+            'Uncertainty': combined_toaerrs,
+            'Frequency': freqs
+        }, copy=False)
 
         return combined_data
 
     @staticmethod
-    def plot_residuals_by_frequency(data, frequency=None, legend=True):
+    def _plot_residuals(data, frequency=None, legend=True):
         """
         Plots timing residuals with uncertainties colored by frequency for Streamlit.
+        Draws on the figure shared by all sessions, so callers must hold
+        _figure_lock() until they are done with the returned figure.
         """
-        unique_freqs = sorted(data['Frequency'].unique())
+        if frequency is not None:
+            freq_mask = data['Frequency'].values == frequency
+            if not freq_mask.any():
+                print(f"Frequency {frequency} MHz not found in the data.")
+                return
+            data = data[freq_mask]
+
+        unique_freqs, freq_index = np.unique(data['Frequency'].values, return_inverse=True)
         markers = ['o', 's', '^', 'D', 'v', '*', 'P', 'X']  # Add more markers if needed
         colors = plt.cm.viridis(np.linspace(0, 1, len(unique_freqs)))
+        point_colors = colors[freq_index]
+        point_markers = freq_index % len(markers)
 
-        fig, ax = plt.subplots(figsize=(12, 6))
+        fig, ax = _figure_skeleton()
+        ax.clear()
 
-        if frequency is not None:
-            if frequency in unique_freqs:
-                freq_data = data[data['Frequency'] == frequency]
-                ax.errorbar(freq_data['Date'], freq_data['Residual'], yerr=freq_data['Uncertainty'], 
-                             fmt=markers[0], markersize=4, label=f'{frequency} MHz', 
-                             color=colors[0], alpha=0.7)
-            else:
-                print(f"Frequency {frequency} MHz not found in the data.")
-                return
-        else:
-            for i, (freq, color) in enumerate(zip(unique_freqs, colors)):
-                freq_data = data[data['Frequency'] == freq]
-                ax.errorbar(freq_data['Date'], freq_data['Residual'], yerr=freq_data['Uncertainty'], 
-                             fmt=markers[i % len(markers)], markersize=4, label=f'{freq} MHz', 
-                             color=color, alpha=0.7)
+        ax.errorbar(data['Date'], data['Residual'], yerr=data['Uncertainty'],
+                    fmt='none', ecolor=point_colors, alpha=0.7)
+        dates = data['Date'].values
+        residuals = data['Residual'].values
+        for m, marker in enumerate(markers[:len(unique_freqs)]):
+            marker_mask = point_markers == m
+            ax.scatter(dates[marker_mask], residuals[marker_mask], c=point_colors[marker_mask],
+                       marker=marker, s=16, alpha=0.7)
 
         ax.set_title('Timing Residuals with Uncertainties Colored by Frequency')
         ax.set_xlabel('Date (MJD)')
         ax.set_ylabel('Residuals (microseconds)')
         ax.grid(True)
         if legend:
-            ax.legend(title="Frequency (MHz)", bbox_to_anchor=(1.05, 1), loc='upper left', ncol=2)
-        plt.tight_layout()
+            handles = [Line2D([], [], marker=markers[i % len(markers)], linestyle='', markersize=4,
+                              color=color, label=f'{freq:g} MHz')
+                       for i, (freq, color) in enumerate(zip(unique_freqs, colors))]
+            ax.legend(handles=handles, title="Frequency (MHz)", bbox_to_anchor=(1.05, 1), loc='upper left', ncol=2)
         return fig
 
-# Cleanup existing files
-for file in os.listdir():
-    if file.endswith(('.zip', '.par', '.tim', '.txt', '.png')) and file != 'fake.par':
-        os.remove(file)
+
+@st.cache_data(max_entries=16, show_spinner="Simulating...")
+def simulate(cadence_days, observing_freqs, red_noise_params, dm_noise_params, totaltime, efac_value, avg_sn, seed):
+    """
+    Runs the full simulation and renders its outputs.
+    Returns the residuals with the .par, .tim and plot PNG contents as bytes.
+    """
+    simulator = ResidualSimulator()
+    data = simulator.simulate_residuals(
+        cadence_days=cadence_days,
+        observing_freqs=observing_freqs,
+        red_noise_params=red_noise_params,
+        dm_noise_params=dm_noise_params,
+        totaltime=totaltime,
+        efac_value=efac_value,
+        avg_sn=avg_sn,
+        seed=seed
+    )
+
+    # libstempo can only write .par and .tim files to a path
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        par_path = os.path.join(tmp_dir, "sim.par")
+        tim_path = os.path.join(tmp_dir, "sim.tim")
+        simulator.psr_combined.savepar(par_path)
+        simulator.psr_combined.savetim(tim_path)
+        with open(par_path, 'rb') as f:
+            par_bytes = f.read()
+        with open(tim_path, 'rb') as f:
+            tim_bytes = f.read()
+
+    plot_buffer = io.BytesIO()
+    with _figure_lock():
+        fig = simulator._plot_residuals(data)
+        fig.savefig(plot_buffer, format='png', dpi=200, bbox_inches='tight')
+
+    return data, par_bytes, tim_bytes, plot_buffer.getvalue()
+
 
 # Streamlit App Setup
 st.title("Pulsar Timing Residual Simulator")
 st.sidebar.header("Simulation Parameters")
 
-# Input Parameters
-cadence_days = st.sidebar.slider("Cadence (days)", 5, 30, 10, step=1)
-frequencies = st.sidebar.multiselect("Observing Frequencies (MHz)", [400, 600, 800, 1400, 1600], default=[1400, 800])
-total_time = st.sidebar.slider("Total Time (years)", 1, 10, 5, step=1)
-avg_sn = st.sidebar.slider("Average S/N Value", 5, 50, 20, step=1)
-efec_value = st.sidebar.slider("EFAC Value", 1.0, 2.0, 1.2, step=0.1)
+# Input Parameters, batched in a form so they only rerun the app on submit
+with st.sidebar.form("sim"):
+    cadence_days = st.slider("Cadence (days)", 5, 30, 10, step=1)
+    frequencies = st.multiselect("Observing Frequencies (MHz)", [400, 600, 800, 1400, 1600], default=[1400, 800])
+    total_time = st.slider("Total Time (years)", 1, 10, 5, step=1)
+    avg_sn = st.slider("Average S/N Value", 5, 50, 20, step=1)
+    efec_value = st.slider("EFAC Value", 1.0, 2.0, 1.2, step=0.1)
 
-red_noise_amplitude_log = st.sidebar.slider("Red Noise Amplitude (log scale)", -18.0, -10.0, -14.0, step=1.0)
-red_noise_amplitude = 10 ** red_noise_amplitude_log
-red_noise_spectral_index = st.sidebar.slider("Red Noise Spectral Index", 0.0, 8.0, 4.0, step=0.1)
+    red_noise_amplitude_log = st.slider("Red Noise Amplitude (log scale)", -18.0, -10.0, -14.0, step=1.0)
+    red_noise_spectral_index = st.slider("Red Noise Spectral Index", 0.0, 8.0, 4.0, step=0.1)
 
-dm_noise_amplitude_log = st.sidebar.slider("DM Noise Amplitude (log scale)", -18.0, -10.0, -14.0, step=1.0)
-dm_noise_amplitude = 10 ** dm_noise_amplitude_log
-dm_noise_spectral_index = st.sidebar.slider("DM Noise Spectral Index", 0.0, 8.0, 4.0, step=0.1)
+    dm_noise_amplitude_log = st.slider("DM Noise Amplitude (log scale)", -18.0, -10.0, -14.0, step=1.0)
+    dm_noise_spectral_index = st.slider("DM Noise Spectral Index", 0.0, 8.0, 4.0, step=0.1)
+
+    # File names for saving
+    par_file_name = st.text_input("PAR File Name", value="temponest_sim.par")
+    tim_file_name = st.text_input("TIM File Name", value="temponest_sim.tim")
+
+    # Unticked, the same inputs reproduce the last noise realization
+    new_seed = st.checkbox("Draw New Noise Realization", value=True)
 
-# File names for saving
-par_file_name = st.sidebar.text_input("PAR File Name", value="temponest_sim.par")
-tim_file_name = st.sidebar.text_input("TIM File Name", value="temponest_sim.tim")
+    submitted = st.form_submit_button("Run Simulation")
+
+red_noise_amplitude = 10 ** red_noise_amplitude_log
+dm_noise_amplitude = 10 ** dm_noise_amplitude_log
 
-# Persistent Simulator Instance
-if "simulator" not in st.session_state:
-    st.session_state.simulator = ResidualSimulator()
-simulator = st.session_state.simulator
+# Seed for all of the injected noise, kept across reruns of this session
+if "rng_seed" not in st.session_state or (submitted and new_seed):
+    st.session_state.rng_seed = int(np.random.SeedSequence().entropy % 2**32)
 
 # Run Simulation Button
-if st.sidebar.button("Run Simulation"):
+if submitted:
+    # tempo2 cannot build a pulsar without TOAs
+    if not frequencies:
+        st.warning("Select at least one observing frequency.")
+        st.stop()
+
     uid = str(uuid.uuid4())[:4]
     summary_file_name = f"simulation_summary_{uid}.txt"
 
@@ -169,64 +256,52 @@ if st.sidebar.button("Run Simulation"):
         dm_noise_spectral_index
     )
 
-    simulated_data = simulator.simulate_residuals(
+    simulated_data, par_bytes, tim_bytes, png_bytes = simulate(
         cadence_days=cadence_days,
-        observing_freqs=frequencies,
+        observing_freqs=tuple(frequencies),
         red_noise_params=red_noise_params,
         dm_noise_params=dm_noise_params,
         totaltime=total_time,
-        efac_value=efec_value
+        efac_value=efec_value,
+        avg_sn=avg_sn,
+        seed=st.session_state.rng_seed
     )
 
     # Plot Results
     st.subheader("Timing Residuals")
-    fig = simulator.plot_residuals_by_frequency(simulated_data)
-    st.pyplot(fig)
+    st.image(png_bytes)
 
     # Save Files as ZIP
     par_file_with_uid = f"{os.path.splitext(par_file_name)[0]}_{uid}.par"
     tim_file_with_uid = f"{os.path.splitext(tim_file_name)[0]}_{uid}.tim"
     residual_plot_file = f"residual_plot_{uid}.png"
-    fig.savefig(residual_plot_file)
-
-    # Save .par and .tim files
-    if simulator.psr_combined is not None:
-        simulator.psr_combined.savepar(par_file_with_uid)
-        simulator.psr_combined.savetim(tim_file_with_uid)
-    else:
-        st.error("Pulsar data not available. Run the simulation first.")
 
     # Write summary file
-    with open(summary_file_name, 'w') as summary_file:
-        summary_file.write(f"Parameter\tValue\n")
-        summary_file.write(f"Cadence (days)\t{cadence_days}\n")
-        summary_file.write(f"Frequencies (MHz)\t{', '.join(map(str, frequencies))}\n")
-        summary_file.write(f"Total Time (years)\t{total_time}\n")
-        summary_file.write(f"Average S/N Value\t{avg_sn}\n")
-        summary_file.write(f"EFAC Value\t{efec_value}\n")
-        summary_file.write(f"Red Noise Amplitude\t{red_noise_amplitude} (log: {red_noise_amplitude_log})\n")
-        summary_file.write(f"Red Noise Spectral Index\t{red_noise_spectral_index}\n")
-        summary_file.write(f"DM Noise Amplitude\t{dm_noise_amplitude} (log: {dm_noise_amplitude_log})\n")
-        summary_file.write(f"DM Noise Spectral Index\t{dm_noise_spectral_index}\n")
+    summary = "\n".join([
+        "Parameter\tValue",
+        f"Cadence (days)\t{cadence_days}",
+        f"Frequencies (MHz)\t{', '.join(map(str, frequencies))}",
+        f"Total Time (years)\t{total_time}",
+        f"Average S/N Value\t{avg_sn}",
+        f"EFAC Value\t{efec_value}",
+        f"Red Noise Amplitude\t{red_noise_amplitude} (log: {red_noise_amplitude_log})",
+        f"Red Noise Spectral Index\t{red_noise_spectral_index}",
+        f"DM Noise Amplitude\t{dm_noise_amplitude} (log: {dm_noise_amplitude_log})",
+        f"DM Noise Spectral Index\t{dm_noise_spectral_index}",
+        f"Random Seed\t{st.session_state.rng_seed}",
+    ]) + "\n"
 
     zip_file_name = f"temponest_simulation_{uid}.zip"
-    with zipfile.ZipFile(zip_file_name, 'w') as zipf:
-        zipf.write(par_file_with_uid)
-        zipf.write(tim_file_with_uid)
-        zipf.write(residual_plot_file)
-        zipf.write(summary_file_name)
-
-    with open(zip_file_name, 'rb') as f:
-        st.download_button(
-            label="Download Simulation ZIP",
-            data=f.read(),
-            file_name=zip_file_name,
-            mime="application/zip"
-        )
-
-    # Cleanup
-    os.remove(par_file_with_uid)
-    os.remove(tim_file_with_uid)
-    os.remove(residual_plot_file)
-    os.remove(summary_file_name)
-    os.remove(zip_file_name)
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr(par_file_with_uid, par_bytes)
+        zipf.writestr(tim_file_with_uid, tim_bytes)
+        zipf.writestr(residual_plot_file, png_bytes)
+        zipf.writestr(summary_file_name, summary)
+
+    st.download_button(
+        label="Download Simulation ZIP",
+        data=zip_buffer.getvalue(),
+        file_name=zip_file_name,
+        mime="application/zip"
+    )